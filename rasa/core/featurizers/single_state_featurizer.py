@@ -1,8 +1,9 @@
 import logging
 import numpy as np
 import scipy.sparse
-from typing import List, Optional, Dict, Text, Set, Any
+from typing import List, Optional, Dict, Text, AbstractSet, Any, Union, Tuple
 from collections import defaultdict
+from functools import lru_cache
 
 import rasa.shared.utils.io
 from rasa.nlu.extractors.extractor import EntityTagSpec
@@ -12,7 +13,10 @@ from rasa.shared.core.domain import SubState, State, Domain
 from rasa.shared.nlu.interpreter import NaturalLanguageInterpreter, RegexInterpreter
 from rasa.shared.core.constants import PREVIOUS_ACTION, ACTIVE_LOOP, USER, SLOTS
 from rasa.shared.constants import DOCS_URL_MIGRATION_GUIDE
-from rasa.shared.core.trackers import is_prev_action_listen_in_state
+from rasa.shared.core.trackers import (
+    DialogueStateTracker,
+    is_prev_action_listen_in_state,
+)
 from rasa.shared.nlu.constants import (
     ENTITIES,
     FEATURE_TYPE_SENTENCE,
@@ -29,6 +33,43 @@ from rasa.utils.tensorflow import model_data_utils
 
 logger = logging.getLogger(__name__)
 
+# attributes which contain the name of the user intent or the bot action
+NAME_ATTRIBUTES = frozenset({INTENT, ACTION_NAME})
+# set of the entities attribute to remove it from the attributes of a sub state
+ENTITIES_ATTRIBUTE = frozenset({ENTITIES})
+# attributes which are always featurized using the domain
+DOMAIN_ATTRIBUTES = frozenset({SLOTS, ACTIVE_LOOP})
+
+
+@lru_cache(maxsize=1024)
+def _one_hot_features(
+    index: Optional[int], size: int, sparse: bool
+) -> Union[np.ndarray, scipy.sparse.coo_matrix]:
+    """Creates one-hot features, which are shared between all states.
+
+    Args:
+        index: The index of the hot feature, `None` if all features are zero.
+        size: The number of features.
+        sparse: Whether to create sparse features.
+
+    Returns:
+        The one-hot features of shape (1, size). Dense features are read-only.
+    """
+    indices = [] if index is None else [index]
+    if sparse:
+        return scipy.sparse.coo_matrix(
+            (
+                np.ones(len(indices), np.float32),
+                (np.zeros(len(indices), np.int32), np.array(indices, np.int32)),
+            ),
+            shape=(1, size),
+        )
+
+    features = np.zeros((1, size), np.float32)
+    features[0, indices] = 1
+    features.flags.writeable = False
+    return features
+
 
 class SingleStateFeaturizer:
     """Base class to transform the dialogue state into an ML format.
@@ -48,6 +89,7 @@ class SingleStateFeaturizer:
         # If that is the case, we need to make sure to "reset" the interpreter.
         self._use_regex_interpreter = False
         self._default_feature_states = {}
+        self._slot_feature_indices = {}
         self.action_texts = []
         self.entity_tag_specs = []
 
@@ -122,6 +164,15 @@ class SingleStateFeaturizer:
         )
         self._default_feature_states[ENTITIES] = convert_to_dict(domain.entity_states)
         self._default_feature_states[SLOTS] = convert_to_dict(domain.slot_states)
+        # map every slot directly to the indices of its features, so that slot
+        # features don't need to be looked up by their names
+        self._slot_feature_indices = {
+            slot.name: [
+                self._default_feature_states[SLOTS][f"{slot.name}_{i}"]
+                for i in range(slot.feature_dimensionality())
+            ]
+            for slot in domain.slots
+        }
         self._default_feature_states[ACTIVE_LOOP] = convert_to_dict(domain.form_names)
         self.action_texts = domain.action_texts
         self.entity_tag_specs = self._create_entity_tag_specs(bilou_tagging)
@@ -132,7 +183,7 @@ class SingleStateFeaturizer:
         # FIXME: the code below is not type-safe, but fixing it
         #        would require more refactoring, for instance using
         #        data classes in our states
-        if attribute in {INTENT, ACTION_NAME}:
+        if attribute in NAME_ATTRIBUTES:
             return {sub_state[attribute]: 1}  # type: ignore[dict-item]
         elif attribute == ENTITIES:
             return {entity: 1 for entity in sub_state.get(ENTITIES, [])}
@@ -150,21 +201,76 @@ class SingleStateFeaturizer:
                 f"It must be one of '{self._default_feature_states.keys()}'."
             )
 
+    def _feature_indices_and_values(
+        self, sub_state: SubState, attribute: Text
+    ) -> Tuple[List[int], List[Any]]:
+        """Gets the indices and values of the features of the given sub state.
+
+        Features which are not part of the default feature states are skipped.
+
+        Args:
+            sub_state: The sub state to featurize.
+            attribute: The attribute of the sub state.
+
+        Returns:
+            The indices of the features and their values.
+        """
+        # featurizers persisted by older versions don't have the slot indices
+        slot_feature_indices = getattr(self, "_slot_feature_indices", None)
+        if attribute == SLOTS and slot_feature_indices:
+            index_value_pairs = [
+                (index, value)
+                for slot_name, slot_as_feature in sub_state.items()
+                for index, value in zip(
+                    slot_feature_indices.get(slot_name, ()), slot_as_feature
+                )
+            ]
+        else:
+            feature_states = self._default_feature_states[attribute]
+            index_value_pairs = [
+                (feature_states[state_feature], value)
+                for state_feature, value in self._state_features_for_attribute(
+                    sub_state, attribute
+                ).items()
+                # check that the value is in default_feature_states to be able to
+                # assign its value
+                if state_feature in feature_states
+            ]
+
+        indices = [index for index, _ in index_value_pairs]
+        values = [value for _, value in index_value_pairs]
+        return indices, values
+
     def _create_features(
         self, sub_state: SubState, attribute: Text, sparse: bool = False
     ) -> List["Features"]:
-        state_features = self._state_features_for_attribute(sub_state, attribute)
-
-        features = np.zeros(len(self._default_feature_states[attribute]), np.float32)
-        for state_feature, value in state_features.items():
-            # check that the value is in default_feature_states to be able to assign
-            # its value
-            if state_feature in self._default_feature_states[attribute]:
-                features[self._default_feature_states[attribute][state_feature]] = value
-        features = np.expand_dims(features, 0)
+        feature_states = self._default_feature_states[attribute]
 
-        if sparse:
-            features = scipy.sparse.coo_matrix(features)
+        if attribute in NAME_ATTRIBUTES:
+            # intents and actions are one-hot encoded, hence their features
+            # don't need to be created for every state
+            features = _one_hot_features(
+                feature_states.get(sub_state[attribute]), len(feature_states), sparse
+            )
+        elif sparse:
+            indices, values = self._feature_indices_and_values(sub_state, attribute)
+            indices = np.array(indices, np.int32)
+            values = np.array(values, np.float32)
+            non_zero = values != 0
+            # build the sparse matrix directly instead of converting
+            # a mostly empty dense vector
+            features = scipy.sparse.coo_matrix(
+                (
+                    values[non_zero],
+                    (np.zeros(np.count_nonzero(non_zero), np.int32), indices[non_zero]),
+                ),
+                shape=(1, len(feature_states)),
+            )
+        else:
+            indices, values = self._feature_indices_and_values(sub_state, attribute)
+            # allocate the features in their final shape and fill them in place
+            features = np.zeros((1, len(feature_states)), np.float32)
+            features[0, indices] = values
 
         return [
             Features(
@@ -172,13 +278,37 @@ class SingleStateFeaturizer:
             )
         ]
 
+    @staticmethod
+    def _sum_sparse_sequence(
+        sequence: scipy.sparse.spmatrix,
+    ) -> scipy.sparse.coo_matrix:
+        """Sums the sparse sequence features over the sequence dimension.
+
+        Instead of summing into a dense vector, all entries are moved to the first
+        row, so that the conversion to CSR sums them up in sparse form.
+
+        Args:
+            sequence: The sparse sequence features of shape (sequence length, units).
+
+        Returns:
+            The summed features of shape (1, units).
+        """
+        sequence = sequence.tocoo()
+        summed = scipy.sparse.coo_matrix(
+            (sequence.data, (np.zeros_like(sequence.col), sequence.col)),
+            shape=(1, sequence.shape[-1]),
+        ).tocsr()
+        summed.eliminate_zeros()
+
+        return summed.tocoo()
+
     @staticmethod
     def _to_sparse_sentence_features(
         sparse_sequence_features: List["Features"],
     ) -> List["Features"]:
         return [
             Features(
-                scipy.sparse.coo_matrix(feature.features.sum(0)),
+                SingleStateFeaturizer._sum_sparse_sequence(feature.features),
                 FEATURE_TYPE_SENTENCE,
                 feature.attribute,
                 feature.origin,
@@ -187,7 +317,7 @@ class SingleStateFeaturizer:
         ]
 
     def _get_features_from_parsed_message(
-        self, parsed_message: Optional[Message], attributes: Set[Text]
+        self, parsed_message: Optional[Message], attributes: AbstractSet[Text]
     ) -> Dict[Text, List["Features"]]:
         if parsed_message is None:
             return {}
@@ -213,14 +343,10 @@ class SingleStateFeaturizer:
         return output
 
     @staticmethod
-    def _get_name_attribute(attributes: Set[Text]) -> Optional[Text]:
+    def _get_name_attribute(attributes: AbstractSet[Text]) -> Optional[Text]:
         # there is always either INTENT or ACTION_NAME
         return next(
-            (
-                attribute
-                for attribute in attributes
-                if attribute in {INTENT, ACTION_NAME}
-            ),
+            (attribute for attribute in attributes if attribute in NAME_ATTRIBUTES),
             None,
         )
 
@@ -242,9 +368,7 @@ class SingleStateFeaturizer:
 
         message = Message(data=sub_state)
         # remove entities from possible attributes
-        attributes = set(
-            attribute for attribute in sub_state.keys() if attribute != ENTITIES
-        )
+        attributes = sub_state.keys() - ENTITIES_ATTRIBUTE
 
         parsed_message = interpreter.featurize_message(message)
         output = self._get_features_from_parsed_message(parsed_message, attributes)
@@ -291,13 +415,39 @@ class SingleStateFeaturizer:
                         sub_state, ENTITIES, sparse=True
                     )
 
-            if state_type in {SLOTS, ACTIVE_LOOP}:
+            if state_type in DOMAIN_ATTRIBUTES:
                 state_features[state_type] = self._create_features(
                     sub_state, state_type, sparse=True
                 )
 
         return state_features
 
+    def encode_states(
+        self, states: List[State], interpreter: NaturalLanguageInterpreter
+    ) -> List[Dict[Text, List["Features"]]]:
+        """Encode the given states with the help of the given interpreter.
+
+        Equal states are only encoded once and share the resulting features.
+
+        Args:
+            states: The states to encode
+            interpreter: The interpreter used to encode the states
+
+        Returns:
+            A list of dictionaries of state_type to list of features.
+        """
+        encoded_states = {}
+        states_features = []
+        for state in states:
+            frozen_state = DialogueStateTracker.freeze_current_state(state)
+            state_features = encoded_states.get(frozen_state)
+            if state_features is None:
+                state_features = self.encode_state(state, interpreter)
+                encoded_states[frozen_state] = state_features
+            states_features.append(state_features)
+
+        return states_features
+
     def encode_entities(
         self,
         entity_data: Dict[Text, Any],
@@ -391,7 +541,7 @@ class BinarySingleStateFeaturizer(SingleStateFeaturizer):
         sparse: bool = False,
     ) -> Dict[Text, List["Features"]]:
         # create a special method that doesn't use passed interpreter
-        name_attribute = self._get_name_attribute(set(sub_state.keys()))
+        name_attribute = self._get_name_attribute(sub_state.keys())
         if name_attribute:
             return {
                 name_attribute: self._create_features(sub_state, name_attribute, sparse)
@@ -1,10 +1,11 @@
+import contextlib
 from pathlib import Path
 
 import jsonpickle
 import logging
 
 from tqdm import tqdm
-from typing import Tuple, List, Optional, Dict, Text, Union, Any
+from typing import Tuple, List, Optional, Dict, Text, Union, Any, Iterator
 import numpy as np
 
 from rasa.core.featurizers.single_state_featurizer import SingleStateFeaturizer
@@ -19,9 +20,16 @@ from rasa.shared.core.constants import USER
 from rasa.shared.nlu.constants import TEXT, INTENT, ENTITIES
 from rasa.shared.exceptions import RasaException
 import rasa.shared.utils.io
+import rasa.utils.io
 from rasa.shared.nlu.training_data.features import Features
 
-FEATURIZER_FILE = "featurizer.json"
+FEATURIZER_FILE = "featurizer.pkl"
+# featurizers of older models were persisted with `jsonpickle`
+LEGACY_FEATURIZER_FILE = "featurizer.json"
+
+# parameters of the polynomial rolling hash used to deduplicate sliced states
+HASH_BASE = 1_000_003
+HASH_MASK = (1 << 64) - 1
 
 logger = logging.getLogger(__name__)
 
@@ -50,6 +58,13 @@ class TrackerFeaturizer:
         """
         self.state_featurizer = state_featurizer
 
+    def __getstate__(self) -> Dict[Text, Any]:
+        """Returns the state of the featurizer which should be persisted."""
+        state = self.__dict__.copy()
+        # the cached prediction states are only valid during a prediction
+        state.pop("_prediction_states_cache", None)
+        return state
+
     @staticmethod
     def _create_states(
         tracker: DialogueStateTracker,
@@ -79,34 +94,142 @@ class TrackerFeaturizer:
             rule_only_data=rule_only_data,
         )
 
+    @contextlib.contextmanager
+    def cache_prediction_states(self) -> Iterator[None]:
+        """Reuses the states of trackers which are featurized several times.
+
+        Policies might create the states of the same tracker several times during
+        one prediction, e.g. the `RulePolicy` creates them for text and intent.
+        Within this context the states of a tracker are cached until its events
+        change. The cache, and hence the references to the trackers, are dropped
+        when the context is left.
+        """
+        self._prediction_states_cache = {}
+        try:
+            yield
+        finally:
+            self._prediction_states_cache = None
+
+    def _create_prediction_states(
+        self,
+        tracker: DialogueStateTracker,
+        domain: Domain,
+        ignore_rule_only_turns: bool = False,
+        rule_only_data: Optional[Dict[Text, Any]] = None,
+    ) -> List[State]:
+        """Create states for the given tracker during prediction.
+
+        The states are reused if they were already created for the same tracker
+        within :meth:`cache_prediction_states`.
+
+        Args:
+            tracker: a :class:`rasa.core.trackers.DialogueStateTracker`
+            domain: a :class:`rasa.shared.core.domain.Domain`
+            ignore_rule_only_turns: If `True` ignore dialogue turns that are present
+                only in rules.
+            rule_only_data: Slots and loops,
+                which only occur in rules but not in stories.
+
+        Returns:
+            a list of states
+        """
+        cache = getattr(self, "_prediction_states_cache", None)
+        if cache is None:
+            return self._create_states(
+                tracker,
+                domain,
+                ignore_rule_only_turns=ignore_rule_only_turns,
+                rule_only_data=rule_only_data,
+            )
+
+        # objects are compared by identity to avoid expensive equality checks
+        cache_objects = (
+            tracker,
+            tracker.events[-1] if tracker.events else None,
+            domain,
+            rule_only_data,
+        )
+        cache_key = (id(tracker), len(tracker.events), ignore_rule_only_turns)
+
+        cached = cache.get(cache_key)
+        if cached is None or any(
+            cache_object is not cached_object
+            for cache_object, cached_object in zip(cache_objects, cached[0])
+        ):
+            states = self._create_states(
+                tracker,
+                domain,
+                ignore_rule_only_turns=ignore_rule_only_turns,
+                rule_only_data=rule_only_data,
+            )
+            cached = (cache_objects, states)
+            cache[cache_key] = cached
+
+        # the sub states are modified afterwards, hence copy them; their values
+        # are immutable, so a shallow copy of each sub state is sufficient
+        return [
+            {key: dict(sub_state) for key, sub_state in state.items()}
+            for state in cached[1]
+        ]
+
     def _featurize_states(
         self,
         trackers_as_states: List[List[State]],
         interpreter: NaturalLanguageInterpreter,
     ) -> List[List[Dict[Text, List["Features"]]]]:
-        return [
+        # encode the states of all trackers in one go, so that states which occur
+        # in several trackers are encoded only once
+        states_features = self.state_featurizer.encode_states(
             [
-                self.state_featurizer.encode_state(state, interpreter)
+                state
+                for tracker_states in trackers_as_states
                 for state in tracker_states
-            ]
-            for tracker_states in trackers_as_states
-        ]
+            ],
+            interpreter,
+        )
+
+        tracker_state_features = []
+        start = 0
+        for tracker_states in trackers_as_states:
+            end = start + len(tracker_states)
+            tracker_state_features.append(states_features[start:end])
+            start = end
+
+        return tracker_state_features
 
     @staticmethod
     def _convert_labels_to_ids(
         trackers_as_actions: List[List[Text]], domain: Domain
     ) -> np.ndarray:
-        # store labels in numpy arrays so that it corresponds to np arrays of input
-        # features
-        return np.array(
+        if not trackers_as_actions:
+            return np.array([])
+
+        # `domain.index_for_action` searches the list of actions, hence look up
+        # the indices in a dict and only fall back to it for unknown actions,
+        # so that it raises the appropriate exception
+        action_to_index = {}
+        for index, action in enumerate(domain.action_names_or_texts):
+            action_to_index.setdefault(action, index)
+
+        # convert the labels of all trackers in one go and split them afterwards
+        label_ids = np.array(
             [
-                np.array(
-                    [domain.index_for_action(action) for action in tracker_actions]
-                )
+                action_to_index[action]
+                if action in action_to_index
+                else domain.index_for_action(action)
                 for tracker_actions in trackers_as_actions
-            ]
+                for action in tracker_actions
+            ],
+            dtype=int,
+        )
+        split_indices = np.cumsum(
+            [len(tracker_actions) for tracker_actions in trackers_as_actions[:-1]]
         )
 
+        # store labels in numpy arrays so that it corresponds to np arrays of input
+        # features
+        return np.array(np.split(label_ids, split_indices))
+
     def _create_entity_tags(
         self,
         trackers_as_entities: List[List[Dict[Text, Any]]],
@@ -138,9 +261,14 @@ class TrackerFeaturizer:
     def _remove_user_text_if_intent(trackers_as_states: List[List[State]]) -> None:
         for states in trackers_as_states:
             for state in states:
+                user_sub_state = state.get(USER)
                 # remove text features to only use intent
-                if state.get(USER, {}).get(INTENT) and state.get(USER, {}).get(TEXT):
-                    del state[USER][TEXT]
+                if (
+                    user_sub_state
+                    and user_sub_state.get(INTENT)
+                    and user_sub_state.get(TEXT)
+                ):
+                    del user_sub_state[TEXT]
 
     def training_states_actions_and_entities(
         self,
@@ -249,17 +377,21 @@ class TrackerFeaturizer:
             if not is_prev_action_listen_in_state(last_state):
                 continue
 
+            user_sub_state = last_state.get(USER)
+            if not user_sub_state:
+                continue
+
             if use_text_for_last_user_input:
                 # remove intent features to only use text
-                if last_state.get(USER, {}).get(INTENT):
-                    del last_state[USER][INTENT]
+                if user_sub_state.get(INTENT):
+                    del user_sub_state[INTENT]
                 # don't add entities if text is used for featurization
-                if last_state.get(USER, {}).get(ENTITIES):
-                    del last_state[USER][ENTITIES]
+                if user_sub_state.get(ENTITIES):
+                    del user_sub_state[ENTITIES]
             else:
                 # remove text features to only use intent
-                if last_state.get(USER, {}).get(TEXT):
-                    del last_state[USER][TEXT]
+                if user_sub_state.get(TEXT):
+                    del user_sub_state[TEXT]
 
         # make sure that all dialogue steps are either intent or text based
         self._remove_user_text_if_intent(trackers_as_states)
@@ -342,10 +474,7 @@ class TrackerFeaturizer:
         if self.state_featurizer is not None:
             self.state_featurizer.entity_tag_specs = None
 
-        # noinspection PyTypeChecker
-        rasa.shared.utils.io.write_text_file(
-            str(jsonpickle.encode(self)), featurizer_file
-        )
+        rasa.utils.io.pickle_dump(featurizer_file, self)
 
     @staticmethod
     def load(path: Text) -> Optional["TrackerFeaturizer"]:
@@ -359,7 +488,13 @@ class TrackerFeaturizer:
         """
         featurizer_file = Path(path) / FEATURIZER_FILE
         if featurizer_file.is_file():
-            return jsonpickle.decode(rasa.shared.utils.io.read_file(featurizer_file))
+            return rasa.utils.io.pickle_load(featurizer_file)
+
+        legacy_featurizer_file = Path(path) / LEGACY_FEATURIZER_FILE
+        if legacy_featurizer_file.is_file():
+            return jsonpickle.decode(
+                rasa.shared.utils.io.read_file(legacy_featurizer_file)
+            )
 
         logger.error(
             f"Couldn't load featurizer for policy. "
@@ -474,7 +609,7 @@ class FullDialogueTrackerFeaturizer(TrackerFeaturizer):
             A list of states.
         """
         trackers_as_states = [
-            self._create_states(
+            self._create_prediction_states(
                 tracker,
                 domain,
                 ignore_rule_only_turns=ignore_rule_only_turns,
@@ -527,15 +662,117 @@ class MaxHistoryTrackerFeaturizer(TrackerFeaturizer):
         return states[-slice_length:]
 
     @staticmethod
-    def _hash_example(
-        states: List[State], action: Text, tracker: DialogueStateTracker
-    ) -> int:
+    def _slice_hashes(
+        state_digests: List[int], slice_length: Optional[int]
+    ) -> List[int]:
+        """Calculates the hashes of the sliced states ending at every state.
+
+        The hash of a slice is a polynomial rolling hash of the digests of its
+        states, so the hash of the next slice is derived from the previous one
+        by adding the new state and removing the one which dropped out of it.
+
+        Args:
+            state_digests: The hashes of the states.
+            slice_length: The slice length
+
+        Returns:
+            The hash of the slice ending at the state with the same index.
+        """
+        base_power = pow(HASH_BASE, slice_length or 0, HASH_MASK + 1)
+
+        slice_hashes = []
+        slice_hash = 0
+        for index, digest in enumerate(state_digests):
+            slice_hash = (slice_hash * HASH_BASE + digest) & HASH_MASK
+            if slice_length and index >= slice_length:
+                # remove the state which dropped out of the slice
+                slice_hash = (
+                    slice_hash - state_digests[index - slice_length] * base_power
+                ) & HASH_MASK
+            slice_hashes.append(slice_hash)
+
+        return slice_hashes
+
+    @staticmethod
+    def _hash_example(slice_hash: int, slice_length: int, action: Text) -> int:
         """Hash states for efficient deduplication."""
-        frozen_states = tuple(
-            s if s is None else tracker.freeze_current_state(s) for s in states
-        )
-        frozen_actions = (action,)
-        return hash((frozen_states, frozen_actions))
+        return hash((slice_hash, slice_length, action))
+
+    def _extract_examples(
+        self,
+        tracker: DialogueStateTracker,
+        domain: Domain,
+        omit_unset_slots: bool = False,
+    ) -> List[Tuple[List[State], Text, Dict[Text, Any], Optional[int]]]:
+        """Creates the training examples of a single tracker.
+
+        Args:
+            tracker: The tracker to transform
+            domain: The domain
+            omit_unset_slots: If `True` do not include the initial values of slots.
+
+        Returns:
+            A list of examples, each consisting of the sliced states, the action,
+            the entity data and the hash of the example which is `None` if
+            duplicates should not be removed.
+        """
+        examples = []
+
+        states = self._create_states(tracker, domain, omit_unset_slots=omit_unset_slots)
+        if self.remove_duplicates:
+            # hash every state only once, the hashes of the sliced states are
+            # then rolled forward state by state instead of rehashing the
+            # whole slice for every action
+            slice_hashes = self._slice_hashes(
+                [
+                    hash(s if s is None else tracker.freeze_current_state(s))
+                    for s in states
+                ],
+                self.max_history,
+            )
+
+        states_length_for_action = 0
+        entity_data = {}
+        for event in tracker.applied_events():
+            if isinstance(event, UserUttered):
+                entity_data = self._entity_data(event)
+
+            if not isinstance(event, ActionExecuted):
+                continue
+
+            states_length_for_action += 1
+
+            # use only actions which can be predicted at a stories start
+            if event.unpredictable:
+                continue
+
+            # slice the states in one go instead of copying all previous states
+            # before slicing them
+            slice_start = (
+                max(0, states_length_for_action - self.max_history)
+                if self.max_history
+                else 0
+            )
+            sliced_states = states[slice_start:states_length_for_action]
+            action = event.action_name or event.action_text
+            hashed = None
+            if self.remove_duplicates:
+                hashed = self._hash_example(
+                    slice_hashes[states_length_for_action - 1],
+                    len(sliced_states),
+                    action,
+                )
+
+            examples.append((sliced_states, action, entity_data, hashed))
+
+            # reset entity_data for the the next turn
+            entity_data = {}
+
+        # the sliced states share the states of the tracker, hence it is enough
+        # to remove the user text from each state once instead of once per slice
+        self._remove_user_text_if_intent([states])
+
+        return examples
 
     def training_states_actions_and_entities(
         self,
@@ -572,52 +809,25 @@ class MaxHistoryTrackerFeaturizer(TrackerFeaturizer):
             disable=rasa.shared.utils.io.is_logging_disabled(),
         )
         for tracker in pbar:
-            states = self._create_states(
+            # the examples of a tracker don't depend on other trackers,
+            # only the deduplication is shared between them
+            for sliced_states, action, entity_data, hashed in self._extract_examples(
                 tracker, domain, omit_unset_slots=omit_unset_slots
-            )
-
-            states_length_for_action = 0
-            entity_data = {}
-            for event in tracker.applied_events():
-                if isinstance(event, UserUttered):
-                    entity_data = self._entity_data(event)
-
-                if not isinstance(event, ActionExecuted):
-                    continue
-
-                states_length_for_action += 1
-
-                # use only actions which can be predicted at a stories start
-                if event.unpredictable:
-                    continue
-
-                sliced_states = self.slice_state_history(
-                    states[:states_length_for_action], self.max_history
-                )
-                if self.remove_duplicates:
-                    hashed = self._hash_example(
-                        sliced_states, event.action_name or event.action_text, tracker
-                    )
-
-                    # only continue with tracker_states that created a
-                    # hashed_featurization we haven't observed
-                    if hashed not in hashed_examples:
+            ):
+                # only continue with tracker_states that created a
+                # hashed_featurization we haven't observed
+                if hashed is None or hashed not in hashed_examples:
+                    if hashed is not None:
                         hashed_examples.add(hashed)
-                        trackers_as_states.append(sliced_states)
-                        trackers_as_actions.append(
-                            [event.action_name or event.action_text]
-                        )
-                        trackers_as_entities.append([entity_data])
-                else:
                     trackers_as_states.append(sliced_states)
-                    trackers_as_actions.append([event.action_name or event.action_text])
+                    trackers_as_actions.append([action])
                     trackers_as_entities.append([entity_data])
 
-                # reset entity_data for the the next turn
-                entity_data = {}
-                pbar.set_postfix({"# actions": "{:d}".format(len(trackers_as_actions))})
-
-        self._remove_user_text_if_intent(trackers_as_states)
+            # don't force a refresh of the progress bar for every tracker,
+            # the postfix is shown with the next regular, throttled update
+            pbar.set_postfix(
+                {"# actions": "{:d}".format(len(trackers_as_actions))}, refresh=False
+            )
 
         logger.debug("Created {} action examples.".format(len(trackers_as_actions)))
 
@@ -647,7 +857,7 @@ class MaxHistoryTrackerFeaturizer(TrackerFeaturizer):
             A list of states.
         """
         trackers_as_states = [
-            self._create_states(
+            self._create_prediction_states(
                 tracker,
                 domain,
                 ignore_rule_only_turns=ignore_rule_only_turns,
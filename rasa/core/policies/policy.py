@@ -29,6 +29,7 @@ from rasa.core.featurizers.tracker_featurizers import (
     TrackerFeaturizer,
     MaxHistoryTrackerFeaturizer,
     FEATURIZER_FILE,
+    LEGACY_FEATURIZER_FILE,
 )
 from rasa.shared.nlu.interpreter import NaturalLanguageInterpreter
 from rasa.shared.core.trackers import DialogueStateTracker
@@ -376,7 +377,9 @@ class Policy:
         if metadata_file.is_file():
             data = json.loads(rasa.shared.utils.io.read_file(metadata_file))
 
-            if (Path(path) / FEATURIZER_FILE).is_file():
+            if (Path(path) / FEATURIZER_FILE).is_file() or (
+                Path(path) / LEGACY_FEATURIZER_FILE
+            ).is_file():
                 featurizer = TrackerFeaturizer.load(path)
                 data["featurizer"] = featurizer
 
@@ -447,7 +447,8 @@ class RulePolicy(MemoizationPolicy):
     def _predict_next_action(
         self, tracker: TrackerWithCachedStates, domain: Domain
     ) -> Tuple[Optional[Text], Optional[Text]]:
-        prediction, prediction_source = self._predict(tracker, domain)
+        with self.featurizer.cache_prediction_states():
+            prediction, prediction_source = self._predict(tracker, domain)
         probabilities = prediction.probabilities
         # do not raise an error if RulePolicy didn't predict anything for stories;
         # however for rules RulePolicy should always predict an action
@@ -1034,7 +1035,9 @@ class RulePolicy(MemoizationPolicy):
         **kwargs: Any,
     ) -> "PolicyPrediction":
         """Predicts the next action (see parent class for more information)."""
-        prediction, _ = self._predict(tracker, domain)
+        # the states of the tracker are created for both text and intent
+        with self.featurizer.cache_prediction_states():
+            prediction, _ = self._predict(tracker, domain)
         return prediction
 
     def _predict(
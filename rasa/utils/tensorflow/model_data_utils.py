@@ -204,7 +204,8 @@ def _create_fake_features(
     # create fake_features for Nones
     fake_features = []
     for _features in example_features:
-        new_features = copy.deepcopy(_features)
+        # the actual features get replaced anyway, hence don't copy them
+        new_features = copy.copy(_features)
         if _features.is_dense():
             new_features.features = np.zeros(
                 (0, _features.features.shape[-1]), _features.features.dtype
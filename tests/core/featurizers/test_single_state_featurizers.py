@@ -25,7 +25,7 @@ from rasa.shared.nlu.constants import (
 )
 from rasa.shared.core.constants import ACTIVE_LOOP, SLOTS
 from rasa.shared.nlu.interpreter import RegexInterpreter
-from rasa.shared.core.slots import Slot
+from rasa.shared.core.slots import Slot, TextSlot, CategoricalSlot
 from rasa.shared.nlu.training_data.features import Features
 
 
@@ -135,6 +135,51 @@ def test_single_state_featurizer_correctly_encodes_non_existing_value():
     assert (encoded[INTENT][0].features != scipy.sparse.coo_matrix([[0, 0]])).nnz == 0
 
 
+def test_single_state_featurizer_encodes_equal_states_once():
+    f = SingleStateFeaturizer()
+    f._default_feature_states[INTENT] = {"a": 0, "b": 1}
+    f._default_feature_states[ACTION_NAME] = {"c": 0, "d": 1, "action_listen": 2}
+
+    states = [
+        {"user": {"intent": "a"}, "prev_action": {"action_name": "action_listen"}},
+        {"prev_action": {"action_name": "d"}},
+        {"user": {"intent": "a"}, "prev_action": {"action_name": "action_listen"}},
+    ]
+
+    encoded = f.encode_states(states, interpreter=RegexInterpreter())
+
+    assert len(encoded) == 3
+    assert encoded[0] is encoded[2]
+    for state, state_features in zip(states, encoded):
+        expected = f.encode_state(state, interpreter=RegexInterpreter())
+        assert list(state_features.keys()) == list(expected.keys())
+        for attribute, features in expected.items():
+            assert (
+                state_features[attribute][0].features != features[0].features
+            ).nnz == 0
+
+
+@pytest.mark.parametrize("sparse", [True, False])
+def test_single_state_featurizer_shares_one_hot_features(sparse: bool):
+    f = SingleStateFeaturizer()
+    f._default_feature_states[INTENT] = {"a": 0, "b": 1}
+
+    features = f._create_features({INTENT: "b"}, INTENT, sparse=sparse)[0]
+    same_features = f._create_features({INTENT: "b"}, INTENT, sparse=sparse)[0]
+    unknown_features = f._create_features({INTENT: "e"}, INTENT, sparse=sparse)[0]
+
+    assert features.features is same_features.features
+    assert features.is_sparse() == sparse
+    assert features.features.dtype == np.float32
+    if sparse:
+        assert (features.features != scipy.sparse.coo_matrix([[0, 1]])).nnz == 0
+        assert unknown_features.features.nnz == 0
+    else:
+        assert np.all(features.features == [[0, 1]])
+        assert np.all(unknown_features.features == [[0, 0]])
+        assert not features.features.flags.writeable
+
+
 def test_single_state_featurizer_prepare_for_training():
     domain = Domain(
         intents=["greet"],
@@ -160,6 +205,39 @@ def test_single_state_featurizer_prepare_for_training():
     assert len(f._default_feature_states[ACTIVE_LOOP]) == 0
 
 
+@pytest.mark.parametrize("sparse", [True, False])
+def test_single_state_featurizer_creates_slot_features_for_domain_slots(sparse: bool):
+    domain = Domain(
+        intents=[],
+        entities=[],
+        slots=[
+            TextSlot("name"),
+            CategoricalSlot("color", values=["red", "blue", "green"]),
+        ],
+        responses={},
+        forms=[],
+        action_names=[],
+    )
+
+    f = SingleStateFeaturizer()
+    f.prepare_for_training(domain, RegexInterpreter())
+    encoded = f._create_features(
+        {"color": (0.0, 1.0, 0.0), "name": (1.0,), "unknown": (1.0,)},
+        SLOTS,
+        sparse=sparse,
+    )[0]
+
+    expected = np.zeros((1, len(domain.slot_states)), np.float32)
+    expected[0, domain.slot_states.index("color_1")] = 1
+    expected[0, domain.slot_states.index("name_0")] = 1
+
+    assert encoded.is_sparse() == sparse
+    if sparse:
+        assert np.all(encoded.features.toarray() == expected)
+    else:
+        assert np.all(encoded.features == expected)
+
+
 def test_single_state_featurizer_creates_encoded_all_actions():
     domain = Domain(
         intents=[],
@@ -308,6 +386,21 @@ def test_single_state_featurizer_uses_dtype_float():
     assert encoded[ACTION_NAME][0].features.dtype == np.float32
 
 
+def test_single_state_featurizer_creates_equal_sparse_and_dense_features():
+    f = SingleStateFeaturizer()
+    f._default_feature_states[SLOTS] = {"e_0": 0, "e_1": 1, "f_0": 2, "g_0": 3}
+    sub_state = {"e": (0.0, 1.0), "g": (0.5,), "h": (1.0,)}
+
+    sparse_features = f._create_features(sub_state, SLOTS, sparse=True)[0]
+    dense_features = f._create_features(sub_state, SLOTS, sparse=False)[0]
+
+    assert sparse_features.is_sparse()
+    assert dense_features.is_dense()
+    assert sparse_features.features.dtype == np.float32
+    assert np.all(sparse_features.features.toarray() == dense_features.features)
+    assert np.all(dense_features.features == [[0.0, 1.0, 0.0, 0.5]])
+
+
 @pytest.mark.timeout(300)  # these can take a longer time than the default timeout
 def test_single_state_featurizer_with_interpreter_state_with_action_listen(
     unpacked_trained_spacybot_path: Text,
@@ -468,6 +561,10 @@ def test_to_sparse_sentence_features():
     assert features[0].origin == sentence_features[0].origin
     assert features[0].attribute == sentence_features[0].attribute
     assert sentence_features[0].features.shape == (1, 10)
+    assert sentence_features[0].is_sparse()
+    assert np.all(
+        sentence_features[0].features.toarray() == features[0].features.sum(0)
+    )
 
 
 @pytest.mark.timeout(300)  # these can take a longer time than the default timeout
@@ -1,5 +1,7 @@
-from typing import Text
+from pathlib import Path
+from typing import Optional, Text
 
+import jsonpickle
 import numpy as np
 import pytest
 
@@ -8,8 +10,11 @@ from rasa.core.featurizers.tracker_featurizers import (
     TrackerFeaturizer,
     FullDialogueTrackerFeaturizer,
     MaxHistoryTrackerFeaturizer,
+    LEGACY_FEATURIZER_FILE,
 )
 from rasa.shared.core.domain import Domain
+from rasa.shared.core.events import ActionExecuted
+import rasa.shared.utils.io
 from rasa.shared.nlu.interpreter import RegexInterpreter
 from tests.core.utilities import tracker_from_dialogue_file
 
@@ -31,6 +36,24 @@ def test_persist_and_load_tracker_featurizer(tmp_path: Text, moodbot_domain: Dom
     assert loaded_tracker_featurizer.state_featurizer is not None
 
 
+def test_load_tracker_featurizer_persisted_with_jsonpickle(
+    tmp_path: Path, moodbot_domain: Domain
+):
+    state_featurizer = SingleStateFeaturizer()
+    state_featurizer.prepare_for_training(moodbot_domain, RegexInterpreter())
+    tracker_featurizer = MaxHistoryTrackerFeaturizer(state_featurizer, max_history=3)
+
+    rasa.shared.utils.io.write_text_file(
+        jsonpickle.encode(tracker_featurizer), tmp_path / LEGACY_FEATURIZER_FILE
+    )
+
+    loaded_tracker_featurizer = TrackerFeaturizer.load(tmp_path)
+
+    assert isinstance(loaded_tracker_featurizer, MaxHistoryTrackerFeaturizer)
+    assert loaded_tracker_featurizer.max_history == 3
+    assert loaded_tracker_featurizer.state_featurizer is not None
+
+
 def test_convert_labels_to_ids(domain: Domain):
     trackers_as_actions = [
         ["utter_greet", "utter_channel"],
@@ -49,6 +72,19 @@ def test_convert_labels_to_ids(domain: Domain):
         assert np.all(expected_array == actual_array)
 
 
+def test_convert_labels_to_ids_for_trackers_of_equal_length(domain: Domain):
+    trackers_as_actions = [["utter_greet"], ["utter_channel"], ["utter_default"]]
+
+    tracker_featurizer = TrackerFeaturizer()
+
+    actual_output = tracker_featurizer._convert_labels_to_ids(
+        trackers_as_actions, domain
+    )
+
+    assert actual_output.shape == (3, 1)
+    assert np.all(actual_output == np.array([[14], [11], [12]]))
+
+
 def test_featurize_trackers_raises_on_missing_state_featurizer(domain: Domain):
     tracker_featurizer = TrackerFeaturizer()
 
@@ -94,3 +130,69 @@ def test_featurize_trackers_with_max_history_tracker_featurizer(moodbot_domain:
     assert len(labels) == 7
     # moodbot doesn't contain e2e entities
     assert not any([any(turn_tags) for turn_tags in entity_tags])
+
+
+@pytest.mark.parametrize("max_history", [None, 2])
+def test_max_history_tracker_featurizer_removes_duplicates(
+    moodbot_domain: Domain, max_history: Optional[int]
+):
+    tracker_featurizer = MaxHistoryTrackerFeaturizer(max_history=max_history)
+
+    tracker = tracker_from_dialogue_file(
+        "data/test_dialogues/moodbot.json", moodbot_domain
+    )
+    states, actions = tracker_featurizer.training_states_and_actions(
+        [tracker], moodbot_domain
+    )
+    states_twice, actions_twice = tracker_featurizer.training_states_and_actions(
+        [tracker, tracker], moodbot_domain
+    )
+
+    assert states_twice == states
+    assert actions_twice == actions
+
+
+def test_prediction_states_are_recreated_if_tracker_changes(moodbot_domain: Domain):
+    tracker_featurizer = MaxHistoryTrackerFeaturizer(max_history=3)
+
+    tracker = tracker_from_dialogue_file(
+        "data/test_dialogues/moodbot.json", moodbot_domain
+    )
+    with tracker_featurizer.cache_prediction_states():
+        states = tracker_featurizer.prediction_states([tracker], moodbot_domain)[0]
+        same_states = tracker_featurizer.prediction_states([tracker], moodbot_domain)[0]
+
+        assert same_states == states
+        assert same_states is not states
+        assert all(
+            same_state is not state for same_state, state in zip(same_states, states)
+        )
+
+        tracker.update(ActionExecuted("utter_greet"))
+        new_states = tracker_featurizer.prediction_states([tracker], moodbot_domain)[0]
+
+        assert new_states != states
+        assert new_states[-1]["prev_action"] == {"action_name": "utter_greet"}
+
+    # the cache doesn't keep a reference to the tracker after the prediction
+    assert tracker_featurizer._prediction_states_cache is None
+
+
+@pytest.mark.parametrize("slice_length", [None, 1, 3])
+def test_slice_hashes_equal_hashes_of_slices(slice_length: Optional[int]):
+    state_digests = [hash(f"state_{i}") for i in range(10)]
+
+    slice_hashes = MaxHistoryTrackerFeaturizer._slice_hashes(
+        state_digests, slice_length
+    )
+    expected_hashes = [
+        MaxHistoryTrackerFeaturizer._slice_hashes(
+            MaxHistoryTrackerFeaturizer.slice_state_history(
+                state_digests[: index + 1], slice_length
+            ),
+            None,
+        )[-1]
+        for index in range(len(state_digests))
+    ]
+
+    assert slice_hashes == expected_hashes
@@ -44,6 +44,8 @@ def test_create_fake_features():
     assert len(fake_features) == 1
     assert fake_features[0].is_dense()
     assert fake_features[0].features.shape == (0, shape)
+    # the original features are not modified
+    assert dense_feature_sentence_features.features.shape == (shape,)
 
     # SPARSE FEATURES
     sparse_feature_sentence_features = Features(